@@ -1,11 +1,16 @@
+import asyncio
 import logging
 import os
-import json
 import re
-import requests
+import aiohttp
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from telegram import Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     ContextTypes,
@@ -14,13 +19,14 @@ from telegram.ext import (
     ConversationHandler,
     CallbackQueryHandler
 )
-from typing import Dict
-from collections import defaultdict, Counter
+from typing import Dict, Optional, Tuple, TypeVar
 
 load_dotenv()
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+REDIS_URL = os.getenv('REDIS_URL')
+WEBHOOK_BASE = os.getenv('WEBHOOK_BASE')
 
 if not TELEGRAM_TOKEN or not OPENWEATHER_API_KEY:
     raise ValueError("Пожалуйста, установите TELEGRAM_TOKEN и OPENWEATHER_API_KEY в .env файле.")
@@ -31,108 +37,168 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+OPENWEATHER_BASE_URL = 'https://api.openweathermap.org'
+
 LANGUAGE_FILES_PATH = os.path.join(os.getcwd(), 'languages')
 IMAGES_PATH = os.path.join(os.getcwd(), 'images')
 
 SUPPORTED_LANGUAGES = ['ru', 'en', 'es']
 
+FORECAST_ENTRIES_PER_DAY = 8
+
+_CITY_RE = re.compile(r"^(?!\s)(?!.*\s$)(?!.*\s{2})[A-Za-zА-Яа-яЁё\-]{2,}(?:\s[A-Za-zА-Яа-яЁё\-]{2,})*$")
+
 user_settings: Dict[int, Dict] = {}
+_user_settings_cache = TTLCache(maxsize=10000, ttl=300)
+redis_client: Optional[aioredis.Redis] = None
+
+http_session: Optional[aiohttp.ClientSession] = None
+
+K = TypeVar('K')
+
+_weather_cache = TTLCache(maxsize=2048, ttl=300)
+_forecast_cache = TTLCache(maxsize=2048, ttl=600)
+_not_found_cache = TTLCache(maxsize=4096, ttl=60)
+_fetch_locks: Dict[tuple, asyncio.Lock] = {}
+_fetch_waiters: Dict[tuple, int] = {}
 
 
 def load_languages() -> Dict[str, Dict]:
     languages = {}
     for lang in SUPPORTED_LANGUAGES:
         try:
-            with open(os.path.join(LANGUAGE_FILES_PATH, f"{lang}.json"), 'r', encoding='utf-8') as file:
-                languages[lang] = json.load(file)
+            with open(os.path.join(LANGUAGE_FILES_PATH, f"{lang}.json"), 'rb') as file:
+                languages[lang] = orjson.loads(file.read())
         except FileNotFoundError:
             logger.error(f"Файл языка для '{lang}' не найден.")
     return languages
 
 
 LANGUAGES = load_languages()
+_RU = LANGUAGES.get('ru', {})
+STRINGS: Dict[Tuple[str, str], str] = {
+    (lang, key): LANGUAGES.get(lang, {}).get(key, _RU[key]) for lang in SUPPORTED_LANGUAGES for key in _RU
+}
+
+
+def tr(language: str, key: str) -> str:
+    return STRINGS.get((language, key)) or STRINGS['ru', key]
 
 
-def get_user_setting(user_id: int) -> Dict:
-    return user_settings.get(user_id, {'language': 'ru'})
+async def get_user_setting(user_id: int) -> Dict:
+    settings = _user_settings_cache.get(user_id)
+    if settings is not None:
+        return settings
+    settings = user_settings.get(user_id, {'language': 'ru'})
+    if redis_client is not None:
+        try:
+            raw = await redis_client.get(f"us:{user_id}")
+        except RedisError as e:
+            logger.error(f"Ошибка при чтении настроек пользователя из Redis: {e}")
+            raw = None
+        if raw:
+            settings = orjson.loads(raw)
+    _user_settings_cache[user_id] = settings
+    return settings
+
+
+async def set_user_setting(user_id: int, setting_key: str, value):
+    settings = dict(await get_user_setting(user_id))
+    settings[setting_key] = value
+    user_settings[user_id] = settings
+    _user_settings_cache[user_id] = settings
+    if redis_client is not None:
+        try:
+            await redis_client.set(f"us:{user_id}", orjson.dumps(settings))
+        except RedisError as e:
+            logger.error(f"Ошибка при сохранении настроек пользователя в Redis: {e}")
 
 
-def set_user_setting(user_id: int, setting_key: str, value):
-    if user_id not in user_settings:
-        user_settings[user_id] = {}
-    user_settings[user_id][setting_key] = value
+_EMOJI_BY_GROUP = {2: "⛈️", 3: "🌦️", 5: "🌧️", 6: "❄️", 7: "🌫️", 8: "☁️"}
+_IMAGE_BY_GROUP = {2: 'thunderstorm.png', 3: 'drizzle.png', 5: 'rain.png', 6: 'snow.png', 7: 'mist.png', 8: 'clouds.png'}
 
 
 def get_weather_emoji(weather_id: int) -> str:
-    if 200 <= weather_id < 300:
-        return "⛈️"
-    elif 300 <= weather_id < 400:
-        return "🌦️"
-    elif 500 <= weather_id < 600:
-        return "🌧️"
-    elif 600 <= weather_id < 700:
-        return "❄️"
-    elif 700 <= weather_id < 800:
-        return "🌫️"
-    elif weather_id == 800:
+    if weather_id == 800:
         return "☀️"
-    elif 800 < weather_id < 900:
-        return "☁️"
-    else:
-        return "🌈"
+    return _EMOJI_BY_GROUP.get(weather_id // 100, "🌈")
 
 
 def get_weather_image(weather_id: int) -> str:
-    if 200 <= weather_id < 300:
-        return 'thunderstorm.png'
-    elif 300 <= weather_id < 400:
-        return 'drizzle.png'
-    elif 500 <= weather_id < 600:
-        return 'rain.png'
-    elif 600 <= weather_id < 700:
-        return 'snow.png'
-    elif 700 <= weather_id < 800:
-        return 'mist.png'
-    elif weather_id == 800:
+    if weather_id == 800:
         return 'clear.png'
-    elif 800 < weather_id < 900:
-        return 'clouds.png'
+    return _IMAGE_BY_GROUP.get(weather_id // 100, 'default.png')
+
+
+_AVAILABLE_IMAGES = frozenset(
+    name for name in {*_IMAGE_BY_GROUP.values(), 'clear.png', 'default.png'}
+    if os.path.isfile(os.path.join(IMAGES_PATH, name))
+)
+
+
+def _load_image_bytes() -> Dict[str, bytes]:
+    images = {}
+    for name in _AVAILABLE_IMAGES:
+        with open(os.path.join(IMAGES_PATH, name), 'rb') as file:
+            images[name] = file.read()
+    return images
+
+
+_IMAGE_BYTES = _load_image_bytes()
+_IMAGE_FILE_IDS: Dict[str, str] = {}
+
+
+async def reply_weather_photo(update: Update, image_file: str, caption: str) -> None:
+    if image_file in _AVAILABLE_IMAGES:
+        file_id = _IMAGE_FILE_IDS.get(image_file)
+        message = await update.message.reply_photo(
+            photo=file_id or _IMAGE_BYTES[image_file],
+            caption=caption,
+            parse_mode='Markdown'
+        )
+        if file_id is None and message.photo:
+            _IMAGE_FILE_IDS[image_file] = message.photo[-1].file_id
     else:
-        return 'default.png'
+        await update.message.reply_text(caption, parse_mode='Markdown')
 
 
-WEATHER, FORECAST, LOCATION = range(3)
+MODE = 0
+
+
+_LANG_NAMES = {
+    'ru': 'Русский',
+    'en': 'English',
+    'es': 'Español'
+}
+
+_LANG_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(_LANG_NAMES[lang], callback_data=lang)] for lang in SUPPORTED_LANGUAGES
+])
 
 
 def get_language_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("Русский", callback_data='ru')],
-        [InlineKeyboardButton("English", callback_data='en')],
-        [InlineKeyboardButton("Español", callback_data='es')]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return _LANG_KEYBOARD
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     user_id = user.id
-    language = get_user_setting(user_id)['language']
-    welcome_message = LANGUAGES.get(language, LANGUAGES['ru']).get('welcome', LANGUAGES['ru']['welcome']).format(
-        name=user.first_name)
+    language = (await get_user_setting(user_id))['language']
+    welcome_message = tr(language, 'welcome').format(name=user.first_name)
     await update.message.reply_text(welcome_message, reply_markup=ForceReply(selective=True))
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    help_text = LANGUAGES.get(language, LANGUAGES['ru']).get('help', LANGUAGES['ru']['help'])
+    language = (await get_user_setting(user_id))['language']
+    help_text = tr(language, 'help')
     await update.message.reply_text(help_text)
 
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    choose_language_text = LANGUAGES.get(language, LANGUAGES['ru']).get('choose_language', 'Please choose a language:')
+    language = (await get_user_setting(user_id))['language']
+    choose_language_text = tr(language, 'choose_language')
     await update.message.reply_text(choose_language_text, reply_markup=get_language_keyboard())
 
 
@@ -142,200 +208,246 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     lang = query.data
     user_id = query.from_user.id
     if lang in LANGUAGES:
-        set_user_setting(user_id, 'language', lang)
-        language_name = {
-            'ru': 'Русский',
-            'en': 'English',
-            'es': 'Español'
-        }.get(lang, lang)
-        success_message = LANGUAGES.get(lang, LANGUAGES['ru']).get('set_language_success',
-                                                                   LANGUAGES['ru']['set_language_success']).format(
-            language=language_name)
+        await set_user_setting(user_id, 'language', lang)
+        language_name = _LANG_NAMES.get(lang, lang)
+        success_message = tr(lang, 'set_language_success').format(language=language_name)
         await query.edit_message_text(success_message)
     else:
-        language = get_user_setting(user_id)['language']
-        invalid_message = LANGUAGES.get(language, LANGUAGES['ru']).get('invalid_language',
-                                                                       LANGUAGES['ru']['invalid_language'])
+        language = (await get_user_setting(user_id))['language']
+        invalid_message = tr(language, 'invalid_language')
         await query.edit_message_text(invalid_message)
 
 
 def validate_city_name(city: str) -> bool:
-    pattern = re.compile(r"^(?!\s)(?!.*\s$)(?!.*\s{2})[A-Za-zА-Яа-яЁё\-]{2,}(?:\s[A-Za-zА-Яа-яЁё\-]{2,})*$")
-    return bool(pattern.match(city))
-
-
-def get_weather(city: str, language: str = 'ru') -> Dict:
+    if not city or city[0].isspace() or city[-1].isspace() or '  ' in city:
+        return False
+    return _CITY_RE.match(city) is not None
+
+
+async def _cached_fetch(cache: TTLCache, key: tuple, city_key: str, fetch) -> Dict:
+    if key in cache:
+        return cache[key]
+    if city_key in _not_found_cache:
+        return _not_found_cache[city_key]
+    lock_key = (id(cache), key)
+    lock = _fetch_locks.setdefault(lock_key, asyncio.Lock())
+    _fetch_waiters[lock_key] = _fetch_waiters.get(lock_key, 0) + 1
     try:
-        url = 'http://api.openweathermap.org/data/2.5/weather'
+        async with lock:
+            if key in cache:
+                return cache[key]
+            if city_key in _not_found_cache:
+                return _not_found_cache[city_key]
+            data = await fetch()
+            if data.get('cod') in [200, "200"]:
+                cache[key] = data
+            elif data.get('cod') in [404, "404"]:
+                _not_found_cache[city_key] = data
+            return data
+    finally:
+        _fetch_waiters[lock_key] -= 1
+        if not _fetch_waiters[lock_key]:
+            del _fetch_waiters[lock_key]
+            del _fetch_locks[lock_key]
+
+
+async def get_weather(city: str, language: str = 'ru') -> Dict:
+    city_key = city.strip().casefold()
+    return await _cached_fetch(_weather_cache, (city_key, language), city_key,
+                               lambda: _fetch_weather(city, language))
+
+
+async def get_forecast(city: str, language: str = 'ru', days: int = 5) -> Dict:
+    city_key = city.strip().casefold()
+    return await _cached_fetch(_forecast_cache, (city_key, language, days), city_key,
+                               lambda: _fetch_forecast(city, language, days))
+
+
+async def _fetch_weather(city: str, language: str) -> Dict:
+    try:
+        url = f'{OPENWEATHER_BASE_URL}/data/2.5/weather'
         params = {
             'q': city,
             'appid': OPENWEATHER_API_KEY,
             'units': 'metric',
             'lang': language
         }
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        async with http_session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 404:
+                response.raise_for_status()
+            return orjson.loads(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
         logger.error(f"Ошибка при запросе погоды: {e}")
         return {'cod': 'error', 'message': str(e)}
 
 
-def get_forecast(city: str, language: str = 'ru') -> Dict:
+async def _fetch_forecast(city: str, language: str, days: int) -> Dict:
     try:
-        url = 'http://api.openweathermap.org/data/2.5/forecast'
+        url = f'{OPENWEATHER_BASE_URL}/data/2.5/forecast'
         params = {
             'q': city,
             'appid': OPENWEATHER_API_KEY,
             'units': 'metric',
-            'lang': language
+            'lang': language,
+            'cnt': days * FORECAST_ENTRIES_PER_DAY
         }
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        async with http_session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 404:
+                response.raise_for_status()
+            return orjson.loads(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
         logger.error(f"Ошибка при запросе прогноза погоды: {e}")
         return {'cod': 'error', 'message': str(e)}
 
 
+async def get_weather_by_coords(lat: float, lon: float, language: str = 'ru') -> Dict:
+    try:
+        url = f'{OPENWEATHER_BASE_URL}/data/2.5/weather'
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': OPENWEATHER_API_KEY,
+            'units': 'metric',
+            'lang': language
+        }
+        async with http_session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
+        logger.error(f"Ошибка при запросе погоды по координатам: {e}")
+        return {'cod': 'error', 'message': str(e)}
+
+
+async def reverse_geocode(lat: float, lon: float) -> list:
+    try:
+        url = f'{OPENWEATHER_BASE_URL}/geo/1.0/reverse'
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'limit': 1,
+            'appid': OPENWEATHER_API_KEY
+        }
+        async with http_session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
+        logger.error(f"Ошибка при обратном геокодировании: {e}")
+        return []
+
+
 async def weather_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    please_enter_city = LANGUAGES.get(language, LANGUAGES['ru']).get('please_enter_city',
-                                                                     LANGUAGES['ru']['please_enter_city'])
+    language = (await get_user_setting(user_id))['language']
+    please_enter_city = tr(language, 'please_enter_city')
     await update.message.reply_text(
         please_enter_city,
         reply_markup=ForceReply(selective=True)
     )
-    return WEATHER
+    context.user_data['mode'] = 'weather'
+    return MODE
 
 
 async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    please_enter_city = LANGUAGES.get(language, LANGUAGES['ru']).get('please_enter_city',
-                                                                     LANGUAGES['ru']['please_enter_city'])
+    language = (await get_user_setting(user_id))['language']
+    please_enter_city = tr(language, 'please_enter_city')
     await update.message.reply_text(
         please_enter_city,
         reply_markup=ForceReply(selective=True)
     )
-    return FORECAST
+    context.user_data['mode'] = 'forecast'
+    return MODE
 
 
 async def location_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    send_location_text = LANGUAGES.get(language, LANGUAGES['ru']).get('send_location', 'Please send your location.')
+    language = (await get_user_setting(user_id))['language']
+    send_location_text = tr(language, 'send_location')
     await update.message.reply_text(send_location_text, reply_markup=ForceReply(selective=True))
-    return LOCATION
+    context.user_data['mode'] = 'location'
+    return MODE
 
 
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
+    language = (await get_user_setting(user_id))['language']
     location = update.message.location
     if location:
-        try:
-            url = 'http://api.openweathermap.org/geo/1.0/reverse'
-            params = {
-                'lat': location.latitude,
-                'lon': location.longitude,
-                'limit': 1,
-                'appid': OPENWEATHER_API_KEY
-            }
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            geo_data = response.json()
-            if geo_data:
-                city = geo_data[0]['name']
-                weather_data = get_weather(city, language)
-                if weather_data.get('cod') in [200, "200"]:
-                    name = weather_data['name']
-                    country = weather_data['sys']['country']
-                    weather_desc = weather_data['weather'][0]['description']
-                    temp = weather_data['main']['temp']
-                    feels_like = weather_data['main']['feels_like']
-                    humidity = weather_data['main']['humidity']
-                    wind_speed = weather_data['wind']['speed']
-                    weather_id = weather_data['weather'][0]['id']
-                    emoji = get_weather_emoji(weather_id)
-
-                    image_file = get_weather_image(weather_id)
-                    image_path = os.path.join(IMAGES_PATH, image_file)
-
-                    response_message = (
-                        f"{emoji} *Погода в {name}, {country}:*\n"
-                        f"• 🌡️ *Температура:* {temp}°C (ощущается как {feels_like}°C)\n"
-                        f"• 💧 *Влажность:* {humidity}%\n"
-                        f"• 💨 *Скорость ветра:* {wind_speed} м/с\n"
-                        f"• 🌥️ *Описание:* {weather_desc.capitalize()}\n"
-                    )
-
-                    if os.path.exists(image_path):
-                        with open(image_path, 'rb') as photo:
-                            await update.message.reply_photo(
-                                photo=photo,
-                                caption=response_message,
-                                parse_mode='Markdown'
-                            )
-                    else:
-                        await update.message.reply_text(response_message, parse_mode='Markdown')
-                else:
-                    not_found_message = LANGUAGES.get(language, LANGUAGES['ru']).get('weather_not_found',
-                                                                                     LANGUAGES['ru'][
-                                                                                         'weather_not_found']).format(
-                        city=city)
-                    await update.message.reply_text(not_found_message)
-            else:
-                weather_not_found_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('weather_not_found',
-                                                                                     'Не удалось определить город по вашей геолокации.').format(
-                    city='неизвестно')
-                await update.message.reply_text(weather_not_found_msg)
-        except requests.RequestException as e:
-            logger.error(f"Ошибка при обратном геокодировании: {e}")
-            api_error_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('api_error',
-                                                                         'Произошла ошибка при получении данных. Пожалуйста, попробуйте позже.')
+        geo_data, weather_data = await asyncio.gather(
+            reverse_geocode(location.latitude, location.longitude),
+            get_weather_by_coords(location.latitude, location.longitude, language)
+        )
+        city = geo_data[0]['name'] if geo_data else None
+        if weather_data.get('cod') in [200, "200"]:
+            name = city or weather_data['name']
+            country = weather_data['sys']['country']
+            weather_desc = weather_data['weather'][0]['description']
+            temp = weather_data['main']['temp']
+            feels_like = weather_data['main']['feels_like']
+            humidity = weather_data['main']['humidity']
+            wind_speed = weather_data['wind']['speed']
+            weather_id = weather_data['weather'][0]['id']
+            emoji = get_weather_emoji(weather_id)
+
+            image_file = get_weather_image(weather_id)
+
+            response_message = (
+                f"{emoji} *Погода в {name}, {country}:*\n"
+                f"• 🌡️ *Температура:* {temp}°C (ощущается как {feels_like}°C)\n"
+                f"• 💧 *Влажность:* {humidity}%\n"
+                f"• 💨 *Скорость ветра:* {wind_speed} м/с\n"
+                f"• 🌥️ *Описание:* {weather_desc.capitalize()}\n"
+            )
+
+            await reply_weather_photo(update, image_file, response_message)
+        elif weather_data.get('cod') == 'error':
+            api_error_msg = tr(language, 'api_error')
             await update.message.reply_text(api_error_msg)
+        else:
+            not_found_message = tr(language, 'weather_not_found').format(city=city or 'неизвестно')
+            await update.message.reply_text(not_found_message)
     else:
-        invalid_location_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('invalid_location',
-                                                                            'Неверная геолокация. Пожалуйста, попробуйте снова.')
+        invalid_location_msg = tr(language, 'invalid_location')
         await update.message.reply_text(invalid_location_msg)
     return ConversationHandler.END
 
 
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    about_text = LANGUAGES.get(language, LANGUAGES['ru']).get('about', 'Информация о боте недоступна.')
+    language = (await get_user_setting(user_id))['language']
+    about_text = tr(language, 'about')
     await update.message.reply_text(about_text)
 
 
-async def handle_weather(update: Update, context: ContextTypes.DEFAULT_TYPE, is_forecast: bool) -> int:
+def _most_frequent(counts: Dict[K, int]) -> K:
+    best_key, best_count = None, 0
+    for key, count in counts.items():
+        if count > best_count:
+            best_key, best_count = key, count
+    return best_key
+
+
+async def handle_weather(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
+    language = (await get_user_setting(user_id))['language']
     city = update.message.text.strip()
+    is_forecast = context.user_data.get('mode') == 'forecast'
 
     if not validate_city_name(city):
-        invalid_city_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('invalid_city',
-                                                                        'Неверное название города. Пожалуйста, попробуйте снова.')
+        invalid_city_msg = tr(language, 'invalid_city')
         await update.message.reply_text(invalid_city_msg)
         return ConversationHandler.END
 
     if is_forecast:
-        data = get_forecast(city, language)
-        not_found_message = LANGUAGES.get(language, LANGUAGES['ru']).get('forecast_not_found',
-                                                                         LANGUAGES['ru']['forecast_not_found']).format(
-            city=city)
+        data = await get_forecast(city, language)
+        not_found_message = tr(language, 'forecast_not_found').format(city=city)
     else:
-        data = get_weather(city, language)
-        not_found_message = LANGUAGES.get(language, LANGUAGES['ru']).get('weather_not_found',
-                                                                         LANGUAGES['ru']['weather_not_found']).format(
-            city=city)
+        data = await get_weather(city, language)
+        not_found_message = tr(language, 'weather_not_found').format(city=city)
 
     if data.get('cod') not in [200, "200"]:
         if data.get('cod') == 'error':
-            api_error_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('api_error',
-                                                                         'Произошла ошибка при получении данных. Пожалуйста, попробуйте позже.')
+            api_error_msg = tr(language, 'api_error')
             await update.message.reply_text(api_error_msg)
         else:
             await update.message.reply_text(not_found_message)
@@ -346,29 +458,36 @@ async def handle_weather(update: Update, context: ContextTypes.DEFAULT_TYPE, is_
             city_name = data['city']['name']
             country = data['city']['country']
             forecast_list = data['list']
-            message = f"📅 *Прогноз погоды в {city_name}, {country} на неделю:*\n\n"
+            parts = [f"📅 *Прогноз погоды в {city_name}, {country} на неделю:*\n\n"]
 
-            daily_forecast = defaultdict(list)
+            daily_forecast: Dict[str, list] = {}
             for entry in forecast_list:
-                date = entry['dt_txt'].split(' ')[0]
-                daily_forecast[date].append(entry)
+                daily_forecast.setdefault(entry['dt_txt'][:10], []).append(entry)
 
             for date, entries in daily_forecast.items():
-                temps = [e['main']['temp'] for e in entries]
-                descriptions = [e['weather'][0]['description'] for e in entries]
-                weather_ids = [e['weather'][0]['id'] for e in entries]
-
-                description = Counter(descriptions).most_common(1)[0][0]
-                weather_id = Counter(weather_ids).most_common(1)[0][0]
+                descriptions: Dict[str, int] = {}
+                weather_ids: Dict[int, int] = {}
+                temp_min, temp_max = float('inf'), float('-inf')
+                for e in entries:
+                    weather = e['weather'][0]
+                    temp = e['main']['temp']
+                    if temp < temp_min:
+                        temp_min = temp
+                    if temp > temp_max:
+                        temp_max = temp
+                    descriptions[weather['description']] = descriptions.get(weather['description'], 0) + 1
+                    weather_ids[weather['id']] = weather_ids.get(weather['id'], 0) + 1
+
+                description = _most_frequent(descriptions)
+                weather_id = _most_frequent(weather_ids)
                 emoji = get_weather_emoji(weather_id)
 
-                temp_min = min(temps)
-                temp_max = max(temps)
+                parts.append(
+                    f"*{date}:* {emoji} {description.capitalize()}\n"
+                    f"• 🌡️ *Температура:* {temp_min}°C - {temp_max}°C\n\n"
+                )
 
-                message += f"*{date}:* {emoji} {description.capitalize()}\n"
-                message += f"• 🌡️ *Температура:* {temp_min}°C - {temp_max}°C\n\n"
-
-            await update.message.reply_text(message, parse_mode='Markdown')
+            await update.message.reply_text(''.join(parts), parse_mode='Markdown')
 
         else:
             name = data['name']
@@ -382,7 +501,6 @@ async def handle_weather(update: Update, context: ContextTypes.DEFAULT_TYPE, is_
             emoji = get_weather_emoji(weather_id)
 
             image_file = get_weather_image(weather_id)
-            image_path = os.path.join(IMAGES_PATH, image_file)
 
             response_message = (
                 f"{emoji} *Погода в {name}, {country}:*\n"
@@ -392,73 +510,72 @@ async def handle_weather(update: Update, context: ContextTypes.DEFAULT_TYPE, is_
                 f"• 🌥️ *Описание:* {weather_desc.capitalize()}\n"
             )
 
-            if os.path.exists(image_path):
-                with open(image_path, 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=response_message,
-                        parse_mode='Markdown'
-                    )
-            else:
-                await update.message.reply_text(response_message, parse_mode='Markdown')
+            await reply_weather_photo(update, image_file, response_message)
 
     except KeyError as e:
         logger.error(f"Ошибка обработки данных погоды: {e}")
-        processing_error_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('processing_error',
-                                                                            'Произошла ошибка при обработке данных погоды.')
+        processing_error_msg = tr(language, 'processing_error')
         await update.message.reply_text(processing_error_msg)
 
     return ConversationHandler.END
 
 
-async def handle_weather_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    return await handle_weather(update, context, is_forecast=False)
-
-
-async def handle_forecast_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    return await handle_weather(update, context, is_forecast=True)
-
-
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    invalid_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('invalid_command', LANGUAGES['ru']['invalid_command'])
+    language = (await get_user_setting(user_id))['language']
+    invalid_msg = tr(language, 'invalid_command')
     await update.message.reply_text(invalid_msg)
 
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    language = get_user_setting(user_id)['language']
-    cancel_msg = LANGUAGES.get(language, LANGUAGES['ru']).get('cancel', 'Действие отменено.')
+    language = (await get_user_setting(user_id))['language']
+    cancel_msg = tr(language, 'cancel')
     await update.message.reply_text(cancel_msg)
     return ConversationHandler.END
 
 
-def main():
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-    weather_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('weather', weather_command)],
-        states={
-            WEATHER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_weather_response)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
+async def init_resources(application: Application) -> None:
+    global http_session, redis_client
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=60)
     )
+    if REDIS_URL:
+        redis_client = aioredis.from_url(
+            REDIS_URL, decode_responses=True, socket_connect_timeout=1, socket_timeout=1
+        )
 
-    forecast_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('forecast', forecast_command)],
-        states={
-            FORECAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_forecast_response)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
+
+async def close_resources(application: Application) -> None:
+    if http_session is not None:
+        await http_session.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+
+
+def main():
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(init_resources)
+        .post_shutdown(close_resources)
+        .build()
     )
 
-    location_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('location', location_command)],
+    conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler('weather', weather_command),
+            CommandHandler('forecast', forecast_command),
+            CommandHandler('location', location_command)
+        ],
         states={
-            LOCATION: [MessageHandler(filters.LOCATION & ~filters.COMMAND, handle_location)]
+            MODE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_weather),
+                MessageHandler(filters.LOCATION & ~filters.COMMAND, handle_location)
+            ]
         },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
+        fallbacks=[CommandHandler('cancel', cancel_command)],
+        allow_reentry=True
     )
 
     application.add_handler(CommandHandler("start", start))
@@ -467,12 +584,18 @@ def main():
     application.add_handler(CallbackQueryHandler(language_callback, pattern='^(ru|en|es)$'))
     application.add_handler(CommandHandler("about", about_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
-    application.add_handler(weather_conv_handler)
-    application.add_handler(forecast_conv_handler)
-    application.add_handler(location_conv_handler)
+    application.add_handler(conv_handler)
     application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 
-    application.run_polling()
+    if WEBHOOK_BASE:
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=int(os.getenv('PORT', '8443')),
+            url_path=TELEGRAM_TOKEN,
+            webhook_url=f"{WEBHOOK_BASE.rstrip('/')}/{TELEGRAM_TOKEN}"
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == '__main__':